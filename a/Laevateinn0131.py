@@ -1,7 +1,28 @@
 import streamlit as st
+import os
+import copy
 import re
-from urllib.parse import urlparse
+import time
+import asyncio
+import hashlib
+import logging
+import socket
+import sqlite3
+import ipaddress
+import threading
+import unicodedata
+import concurrent.futures
+from collections import Counter, OrderedDict
+from urllib.parse import urlparse, urljoin
 import google.generativeai as genai
+
+# リダイレクト追跡用（未インストールの場合は追跡機能を無効化）
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
  
 # ページ設定
 st.set_page_config(
@@ -23,6 +44,8 @@ if 'api_key_validated' not in st.session_state:
     st.session_state.api_key_validated = False
 if 'phone_number' not in st.session_state:
     st.session_state.phone_number = ""
+if 'email_analysis_cache' not in st.session_state:
+    st.session_state.email_analysis_cache = {}
  
 # クイズデータ
 QUIZ_SAMPLES = [
@@ -165,50 +188,6 @@ JSON以外の文章は出力しないでください。
         st.error(f"AI分析エラー：{str(e)}")
         return None
  
-# Gemini AIでメール分析
-def analyze_email_with_ai(content, model):
-    prompt = f"""
-あなたはフィッシング詐欺対策の専門家です。以下のメール内容を分析し、JSON形式で回答してください。
-
-メール内容:
-{content}
-
-以下の項目を分析してください:
-1. フィッシング詐欺の可能性（危険/注意/安全）
-2. リスクスコア（0-100）
-3. 検出された疑わしいキーワード
-4. 緊急性をあおる表現の有無
-5. URLの安全性
-6. 警告メッセージ（あれば）
-7. 詳細な分析結果
-
-回答は必ず以下のJSON形式で:
-{{
-    "risk_level": "注意",
-    "risk_score": 60,
-    "warnings": ["警告１","警告２"],
-    "details": ["詳細１","詳細２"],
-    "ai_analysis": "AIによる総合分析と推奨事項"
-}}
-"""
-   
-    try:
-        response = model.generate_content(prompt)
-        import json
-        result_text = response.text.strip()
-
-        if '```json' in result_text:
-            result_text = result_text.split('```json')[1].split('```')[0].strip()
-        elif '```' in result_text:
-            result_text = result_text.split('```')[1].split('```')[0].strip()
-        
-        result = json.loads(result_text)
-        result['ai_powered'] = True
-        return result
-    except Exception as e:
-        st.error(f"AI分析エラー:{str(e)}")
-        return None
- 
 # 従来の電話番号分析関数（フォールバック用）
 def analyze_phone_number(number):
     normalized = re.sub(r'[-\s()]+', '', number)
@@ -270,6 +249,10 @@ def analyze_phone_number(number):
         'ai_powered': False
     }
  
+# 短縮URLサービスのドメイン
+SHORTENER_DOMAINS = ['bit.ly', 'tinyurl.com', 't.co']
+SHORTENER_WARNING = 'ℹ️ 短縮URLです。実際のリンク先を確認してください'
+ 
 # URL分析関数（フォールバック用）
 def analyze_url(url):
     risk_level = '安全'
@@ -302,9 +285,8 @@ def analyze_url(url):
             risk_score = max(risk_score, 60)
        
         # 短縮URLチェック
-        short_domains = ['bit.ly', 'tinyurl.com', 't.co']
-        if any(s in parsed.hostname for s in short_domains):
-            warnings.append('ℹ️ 短縮URLです。実際のリンク先を確認してください')
+        if any(s in parsed.hostname for s in SHORTENER_DOMAINS):
+            warnings.append(SHORTENER_WARNING)
    
     except:
         warnings.append('❌ 無効なURL形式です')
@@ -320,36 +302,32 @@ def analyze_url(url):
         'ai_powered': False
     }
  
-# メール分析関数（フォールバック用）
-def analyze_email(content):
+# 疑わしいキーワード
+SUSPICIOUS_KEYWORDS = ['verify account', 'urgent action', 'suspended', 'アカウント確認', '緊急', '本人確認', 'パスワード更新']
+# 緊急性を煽る表現
+URGENT_WORDS = ['今すぐ', '直ちに', '24時間以内', 'immediately', 'urgent']
+ 
+# キーワード・URLの分析結果からメールのルールベース判定を組み立てる
+def build_email_rule_result(found_keywords, urgent, url_results):
     risk_level = '安全'
     risk_score = 10
     warnings = []
     details = []
    
-    # 疑わしいキーワード
-    suspicious_keywords = ['verify account', 'urgent action', 'suspended', 'アカウント確認', '緊急', '本人確認', 'パスワード更新']
-    found_keywords = [k for k in suspicious_keywords if k.lower() in content.lower()]
-   
     if found_keywords:
         warnings.append(f"⚠️ 疑わしいキーワード検出: {', '.join(found_keywords[:3])}")
         risk_level = '注意'
         risk_score = 50
    
     # URL検出
-    url_matches = re.findall(r'https?://[^\s<>"]+', content)
-    if url_matches:
-        details.append(f"検出されたURL数: {len(url_matches)}")
-        for url in url_matches[:2]:
-            url_analysis = analyze_url(url)
-            if url_analysis['risk_level'] == '危険':
-                risk_level = '危険'
-                risk_score = 90
-                warnings.append('🚨 危険なURLが含まれています')
-   
-    # 緊急性を煽る表現
-    urgent_words = ['今すぐ', '直ちに', '24時間以内', 'immediately', 'urgent']
-    if any(w.lower() in content.lower() for w in urgent_words):
+    if url_results:
+        details.append(f"検出されたURL数: {len(url_results)}")
+        if any(r['risk_level'] == '危険' for r in url_results):
+            risk_level = '危険'
+            risk_score = 90
+            warnings.append('🚨 危険なURLが含まれています')
+   
+    if urgent:
         warnings.append('⚠️ 緊急性を煽る表現が含まれています')
         risk_score = min(risk_score + 20, 100)
    
@@ -361,6 +339,267 @@ def analyze_email(content):
         'ai_powered': False
     }
  
+# メール内の電話番号・URL抽出用パターン
+URL_PATTERN = re.compile(r'https?://[^\s<>"「」、。]+')
+PHONE_PATTERN = re.compile(
+    r'(?<![\d+])'
+    r'(?:\+\d{1,3}(?:[-\s]?\d{1,4}){2,4}'
+    r'|\(?0\d{1,4}\)?[-\s]?\d{1,4}[-\s]?\d{3,4})'
+    r'(?!\d)'
+)
+
+# リスクレベルの強さ（総合判定で最大値を取るために使用）
+RISK_RANK = {'エラー': 0, '安全': 1, '緊急': 1, '注意': 2, '危険': 3}
+
+# AIを再実行しない本文の類似度の下限
+AI_REANALYSIS_SIMILARITY = 0.9
+
+# メール本文から電話番号とURLを抽出
+def extract_entities(content):
+    # 全角数字・記号を半角に揃える
+    text = unicodedata.normalize('NFKC', content)
+   
+    urls = []
+    for url in URL_PATTERN.findall(text):
+        if url not in urls:
+            urls.append(url)
+   
+    # URL内の数字を電話番号と誤検出しないよう除外してから検索
+    phones = []
+    seen = set()
+    for match in PHONE_PATTERN.findall(URL_PATTERN.sub(' ', text)):
+        number = match.strip()
+        normalized = re.sub(r'[-\s()+]+', '', number)
+        # 日付や金額などを除外するため桁数で絞り込む
+        if number.startswith('+'):
+            if not 8 <= len(normalized) <= 15:
+                continue
+        elif not 10 <= len(normalized) <= 11:
+            continue
+        if normalized not in seen:
+            seen.add(normalized)
+            phones.append(number)
+   
+    return {'phones': phones, 'urls': urls}
+ 
+# メール本文（または段落）からキーワード・電話番号・URLを走査
+def scan_email_text(text):
+    lowered = text.lower()
+    scan = extract_entities(text)
+    scan['keywords'] = [k for k in SUSPICIOUS_KEYWORDS if k.lower() in lowered]
+    scan['urgent'] = any(w.lower() in lowered for w in URGENT_WORDS)
+    return scan
+ 
+# メール本文を空行区切りの段落に分割
+def split_email_paragraphs(content):
+    return [p.strip() for p in re.split(r'\n\s*\n', content) if p.strip()]
+ 
+# 表記ゆれを除いた本文の文字4-gramを指紋として使う
+def content_fingerprint(content):
+    text = re.sub(r'[\W_]+', '', unicodedata.normalize('NFKC', content).lower())
+    return {text[i:i + 4] for i in range(max(len(text) - 3, 1))}
+ 
+# 2つの指紋の類似度（Jaccard係数）
+def fingerprint_similarity(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+ 
+# AIに問い合わせるべき判定の曖昧なエンティティか
+def is_ambiguous_entity(entity):
+    if entity['risk_level'] == '注意':
+        return True
+    # 解析できなかったURLはAIに問い合わせても判定できない
+    if entity['risk_level'] == 'エラー':
+        return False
+    if entity['kind'] == 'phone':
+        return entity.get('caller_type') == '不明'
+    # 短縮URLはリンク先が分からないため曖昧とみなす
+    try:
+        hostname = urlparse(entity['value']).hostname or ''
+    except ValueError:
+        return False
+    return any(s in hostname for s in SHORTENER_DOMAINS)
+ 
+# Gemini AIでメール内の電話番号・URLを一括分析
+def analyze_entities_with_ai(content, entities, model):
+    kind_labels = {'phone': '電話番号', 'url': 'URL'}
+    entity_lines = "\n".join(
+        f"[{i}] {kind_labels[e['kind']]}: {e['value']} (ルールベース判定: {e['risk_level']})"
+        for i, e in enumerate(entities, 1)
+    ) or "（なし）"
+    prompt = f"""
+あなたはフィッシング詐欺対策の専門家です。以下のメール内容と、その中から抽出された判定の難しい電話番号・URLを分析し、JSON形式で回答してください。
+
+メール内容:
+{content}
+
+判定対象の電話番号・URL:
+{entity_lines}
+
+以下の項目を分析してください:
+1. メール全体のフィッシング詐欺の可能性（危険/注意/安全）とリスクスコア（0-100）
+2. メール全体の警告メッセージ（あれば）
+3. 判定対象それぞれのリスクレベル（危険/注意/安全）、リスクスコア（0-100）、警告メッセージ、分析コメント
+
+回答は必ず以下のJSON形式で（entitiesのidは判定対象の番号）:
+{{
+    "risk_level": "注意",
+    "risk_score": 60,
+    "warnings": ["警告１","警告２"],
+    "ai_analysis": "AIによる総合分析と推奨事項",
+    "entities": [
+        {{"id": 1, "risk_level": "注意", "risk_score": 60, "warnings": ["警告１"], "ai_analysis": "分析コメント"}}
+    ]
+}}
+
+JSON以外の文章は出力しないでください。
+"""
+   
+    try:
+        response = model.generate_content(prompt)
+        import json
+        result_text = response.text.strip()
+
+        if '```json' in result_text:
+            result_text = result_text.split('```json')[1].split('```')[0].strip()
+        elif '```' in result_text:
+            result_text = result_text.split('```')[1].split('```')[0].strip()
+        
+        result = json.loads(result_text)
+        result['ai_powered'] = True
+        return result
+    except Exception as e:
+        st.error(f"AI分析エラー:{str(e)}")
+        return None
+ 
+# AIの判定結果の形式を検証（不正な場合はNone）
+def validate_ai_verdict(verdict):
+    if not isinstance(verdict, dict) or verdict.get('risk_level') not in RISK_RANK:
+        return None
+    try:
+        risk_score = min(max(int(verdict.get('risk_score')), 0), 100)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    warnings = verdict.get('warnings', [])
+    if not isinstance(warnings, list):
+        return None
+    return {**verdict, 'risk_score': risk_score, 'warnings': [str(w) for w in warnings]}
+ 
+# メール内の電話番号・URLをまとめて分析
+def analyze_email_entities(content, model=None, cache=None):
+    # cacheを渡すと前回の走査結果・AI判定を再利用して差分だけを分析する
+    if cache is None:
+        cache = {}
+   
+    # 段落ごとに走査し、変更のない段落は前回の結果を使う
+    previous_scans = cache.get('paragraphs', {})
+    scans = {}
+    for paragraph in split_email_paragraphs(content):
+        key = hashlib.sha1(paragraph.encode('utf-8')).hexdigest()
+        if key not in scans:
+            scans[key] = previous_scans.get(key) or scan_email_text(paragraph)
+    cache['paragraphs'] = scans
+   
+    found_keywords = []
+    urgent = False
+    phones = []
+    urls = []
+    seen_phones = set()
+    for scan in scans.values():
+        found_keywords += [k for k in scan['keywords'] if k not in found_keywords]
+        urgent = urgent or scan['urgent']
+        for number in scan['phones']:
+            normalized = re.sub(r'\D', '', number)
+            if normalized not in seen_phones:
+                seen_phones.add(normalized)
+                phones.append(number)
+        urls += [url for url in scan['urls'] if url not in urls]
+   
+    # まずは全エンティティをルールベースで高速にチェック（分析済みのものは再利用）
+    previous_entities = cache.get('entities', {})
+    rule_results = {}
+    for kind, values, analyze in (('phone', phones, analyze_phone_number), ('url', urls, analyze_url)):
+        for value in values:
+            rule_results[(kind, value)] = previous_entities.get((kind, value)) or {**analyze(value), 'kind': kind, 'value': value}
+    cache['entities'] = rule_results
+    entities = [copy.deepcopy(r) for r in rule_results.values()]
+   
+    result = build_email_rule_result(found_keywords, urgent, [e for e in entities if e['kind'] == 'url'])
+   
+    # 判定の曖昧なものだけをまとめて1回のAI呼び出しで分析
+    if model is not None:
+        ambiguous = [e for e in entities if is_ambiguous_entity(e)]
+        ambiguous_keys = {(e['kind'], e['value']) for e in ambiguous}
+        fingerprint = content_fingerprint(content)
+        previous_ai = cache.get('ai')
+       
+        # 内容が実質的に変わっていなければ前回のAI判定を使う
+        if (previous_ai
+                and ambiguous_keys <= previous_ai['entity_keys']
+                and fingerprint_similarity(previous_ai['fingerprint'], fingerprint) >= AI_REANALYSIS_SIMILARITY):
+            ai_result = previous_ai['result']
+            verdicts = previous_ai['verdicts']
+        else:
+            # 形式の不正な回答は使わず、ルールベースの結果にフォールバックする
+            ai_result = validate_ai_verdict(analyze_entities_with_ai(content, ambiguous, model))
+            verdicts = {}
+            if ai_result:
+                raw_verdicts = ai_result.get('entities', [])
+                for verdict in raw_verdicts if isinstance(raw_verdicts, list) else []:
+                    try:
+                        entity_id = int(verdict['id'])
+                    except (KeyError, ValueError, TypeError):
+                        continue
+                    # 負のインデックスで別のエンティティに適用されないよう範囲外は捨てる
+                    if not 1 <= entity_id <= len(ambiguous):
+                        continue
+                    entity = ambiguous[entity_id - 1]
+                    verdict = validate_ai_verdict(verdict)
+                    if verdict is None:
+                        continue
+                    verdicts[(entity['kind'], entity['value'])] = verdict
+                cache['ai'] = {
+                    'fingerprint': fingerprint,
+                    'entity_keys': ambiguous_keys,
+                    'result': ai_result,
+                    'verdicts': verdicts
+                }
+       
+        if ai_result:
+            for entity in entities:
+                verdict = verdicts.get((entity['kind'], entity['value']))
+                if verdict is None:
+                    continue
+                entity['risk_level'] = verdict['risk_level']
+                entity['risk_score'] = verdict['risk_score']
+                entity['warnings'] = entity['warnings'] + verdict['warnings']
+                if verdict.get('ai_analysis'):
+                    entity['ai_analysis'] = verdict['ai_analysis']
+                entity['ai_powered'] = True
+           
+            result['risk_level'] = ai_result['risk_level']
+            result['risk_score'] = ai_result['risk_score']
+            result['warnings'] = result['warnings'] + ai_result['warnings']
+            if ai_result.get('ai_analysis'):
+                result['ai_analysis'] = ai_result['ai_analysis']
+            result['ai_powered'] = True
+   
+    # 総合判定は最も危険なエンティティに合わせる
+    for entity in entities:
+        if RISK_RANK.get(entity['risk_level'], 0) > RISK_RANK.get(result['risk_level'], 0):
+            result['risk_level'] = entity['risk_level']
+        result['risk_score'] = max(result['risk_score'], entity['risk_score'])
+        if entity['risk_level'] == '危険':
+            message = '🚨 危険な電話番号が含まれています' if entity['kind'] == 'phone' else '🚨 危険なURLが含まれています'
+            if message not in result['warnings']:
+                result['warnings'].append(message)
+   
+    if phones:
+        result['details'].append(f"検出された電話番号数: {len(phones)}")
+    result['entities'] = entities
+    return result
+ 
 # リスク表示関数
 def display_risk_result(result):
     # カラー設定
@@ -393,11 +632,431 @@ def display_risk_result(result):
     if result.get('warnings'):
         st.warning("**⚠️ 警告**\n\n" + "\n\n".join(result['warnings']))
    
+    # リダイレクトの経路
+    if len(result.get('redirect_chain', [])) > 1:
+        st.info("**↪️ リダイレクト経路**\n\n" + "\n\n".join(
+            f"{i}. `{u}`" for i, u in enumerate(result['redirect_chain'], 1)
+        ))
+   
     # 詳細情報
     if result.get('details'):
         with st.expander("📋 詳細情報"):
             for detail in result['details']:
                 st.write(detail)
+   
+    # メール内の電話番号・URLごとの内訳
+    if result.get('entities'):
+        st.markdown("#### 🔎 検出された電話番号・URL")
+        for entity in result['entities']:
+            icon = '📞' if entity['kind'] == 'phone' else '🔗'
+            entity_color = color_map.get(entity['risk_level'], 'gray')
+            st.markdown(
+                f"{icon} `{entity['value']}` — :{entity_color}[{entity['risk_level']}] "
+                f"({entity['risk_score']}/100)"
+                + (" 🤖" if entity.get('ai_powered', False) else "")
+            )
+            if entity.get('caller_type'):
+                st.caption(f"発信者タイプ: {entity['caller_type']}")
+            if entity.get('ai_analysis'):
+                st.caption(entity['ai_analysis'])
+            for warning in entity.get('warnings', []):
+                st.caption(warning)
+ 
+# 判定結果の保存先（環境変数で変更可能）
+TELEMETRY_DB_PATH = os.environ.get(
+    'LOOKUP_TELEMETRY_DB',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lookup_telemetry.db')
+)
+TELEMETRY_BUCKET_SECONDS = 3600
+TELEMETRY_RETENTION_HOURS = 24 * 7
+TELEMETRY_MAX_BUFFER = 100000
+ 
+# チェック結果を追記専用で記録するストア
+class LookupTelemetryStore:
+    # チェック処理ではバッファに追加するだけで、SQLite(WAL)への書き込みは
+    # バックグラウンドのスレッドが一定件数または一定時間ごとにまとめて行う。
+    # 1時間単位の集計カウンタも書き込み時に更新し、トレンド表示に使う。
+
+    def __init__(self, path, batch_size=200, flush_interval=2.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._last_prune_bucket = None
+       
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS lookups (
+                id INTEGER PRIMARY KEY,
+                ts REAL NOT NULL,
+                kind TEXT NOT NULL,
+                entity TEXT NOT NULL,
+                risk_level TEXT NOT NULL,
+                risk_score INTEGER NOT NULL,
+                ai_powered INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS entity_counts (
+                bucket INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                entity TEXT NOT NULL,
+                lookups INTEGER NOT NULL,
+                max_risk_score INTEGER NOT NULL,
+                PRIMARY KEY (bucket, kind, entity)
+            );
+            CREATE INDEX IF NOT EXISTS idx_entity_counts_kind_bucket
+                ON entity_counts (kind, bucket);
+            CREATE TABLE IF NOT EXISTS risk_counts (
+                kind TEXT NOT NULL,
+                risk_level TEXT NOT NULL,
+                lookups INTEGER NOT NULL,
+                PRIMARY KEY (kind, risk_level)
+            );
+        """)
+        self._conn.commit()
+       
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def record(self, kind, entity, risk_level, risk_score, ai_powered):
+        # 記録の失敗でチェック結果の表示を妨げないよう、不正なスコアは記録しない
+        try:
+            risk_score = min(max(int(risk_score), 0), 100)
+        except (TypeError, ValueError, OverflowError):
+            return
+        with self._buffer_lock:
+            self._buffer.append((time.time(), kind, entity, str(risk_level), risk_score, int(bool(ai_powered))))
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            # 書き込みスレッドが止まると以降の記録が保存されなくなるため、例外はすべて捕捉する
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning("テレメトリの書き込みに失敗しました: %s", e)
+
+    def flush(self):
+        with self._buffer_lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+        try:
+            self._write_batch(batch)
+        except sqlite3.Error:
+            # 書き込めなかったバッチはバッファの先頭に戻す（上限を超えた古い記録は捨てる）
+            with self._buffer_lock:
+                self._buffer = (batch + self._buffer)[-TELEMETRY_MAX_BUFFER:]
+            raise
+
+    def _write_batch(self, batch):
+       
+        # バッチ内で事前に集計してからカウンタを更新する
+        entity_counts = {}
+        risk_counts = Counter()
+        for ts, kind, entity, risk_level, risk_score, _ in batch:
+            key = (int(ts // TELEMETRY_BUCKET_SECONDS), kind, entity)
+            lookups, max_score = entity_counts.get(key, (0, 0))
+            entity_counts[key] = (lookups + 1, max(max_score, risk_score))
+            risk_counts[(kind, risk_level)] += 1
+       
+        with self._db_lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO lookups (ts, kind, entity, risk_level, risk_score, ai_powered) VALUES (?, ?, ?, ?, ?, ?)",
+                batch
+            )
+            self._conn.executemany(
+                """INSERT INTO entity_counts (bucket, kind, entity, lookups, max_risk_score) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (bucket, kind, entity) DO UPDATE SET
+                       lookups = lookups + excluded.lookups,
+                       max_risk_score = MAX(max_risk_score, excluded.max_risk_score)""",
+                [(*key, lookups, max_score) for key, (lookups, max_score) in entity_counts.items()]
+            )
+            self._conn.executemany(
+                """INSERT INTO risk_counts (kind, risk_level, lookups) VALUES (?, ?, ?)
+                   ON CONFLICT (kind, risk_level) DO UPDATE SET lookups = lookups + excluded.lookups""",
+                [(*key, count) for key, count in risk_counts.items()]
+            )
+           
+            # 保持期間を過ぎた集計バケットは1時間に1回削除する
+            current_bucket = int(time.time() // TELEMETRY_BUCKET_SECONDS)
+            if self._last_prune_bucket != current_bucket:
+                self._conn.execute(
+                    "DELETE FROM entity_counts WHERE bucket < ?",
+                    (current_bucket - TELEMETRY_RETENTION_HOURS,)
+                )
+                self._last_prune_bucket = current_bucket
+
+    def trending(self, kind, hours=24, limit=10):
+        since_bucket = int(time.time() // TELEMETRY_BUCKET_SECONDS) - hours + 1
+        with self._db_lock:
+            rows = self._conn.execute(
+                """SELECT entity, SUM(lookups) AS total, MAX(max_risk_score)
+                   FROM entity_counts
+                   WHERE kind = ? AND bucket >= ?
+                   GROUP BY entity
+                   ORDER BY total DESC, entity
+                   LIMIT ?""",
+                (kind, since_bucket, limit)
+            ).fetchall()
+        return [{'entity': e, 'lookups': n, 'max_risk_score': s} for e, n, s in rows]
+
+    def risk_totals(self):
+        with self._db_lock:
+            rows = self._conn.execute("SELECT kind, risk_level, lookups FROM risk_counts").fetchall()
+        totals = {}
+        for kind, risk_level, lookups in rows:
+            totals.setdefault(kind, {})[risk_level] = lookups
+        return totals
+ 
+# テレメトリストアの取得（全セッションで共有）
+@st.cache_resource
+def get_telemetry_store():
+    try:
+        return LookupTelemetryStore(TELEMETRY_DB_PATH)
+    except sqlite3.Error:
+        return None
+ 
+# 記録用にエンティティを正規化
+def normalize_entity(kind, value):
+    value = unicodedata.normalize('NFKC', value).strip()
+    if kind == 'phone':
+        digits = re.sub(r'\D', '', value)
+        return '+' + digits if value.startswith('+') else digits
+    if kind == 'url':
+        # 解析できないURLはそのまま小文字で記録する
+        try:
+            hostname = (urlparse(value).hostname or value).lower()
+        except ValueError:
+            hostname = value.lower()
+        return hostname[4:] if hostname.startswith('www.') else hostname
+    # メール本文はそのまま保存せず指紋のみを記録
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()[:16]
+ 
+# 判定結果をテレメトリストアに記録
+def record_lookup(result, kind, value):
+    store = get_telemetry_store()
+    if store is None:
+        return
+    # 記録の失敗がチェック結果の画面に例外として出ないようにする
+    try:
+        store.record(kind, normalize_entity(kind, value), result.get('risk_level'), result.get('risk_score'), result.get('ai_powered', False))
+        # メール内の電話番号・URLも個別に記録
+        for entity in result.get('entities', []):
+            store.record(
+                entity['kind'],
+                normalize_entity(entity['kind'], entity['value']),
+                entity['risk_level'],
+                entity['risk_score'],
+                entity.get('ai_powered', False)
+            )
+    except Exception as e:
+        logger.warning("チェック結果を記録できませんでした: %s", e)
+ 
+# リダイレクト追跡の設定
+REDIRECT_MAX_HOPS = 10
+REDIRECT_TIMEOUT_SECONDS = 8.0
+REDIRECT_CACHE_TTL_SECONDS = 3600
+REDIRECT_CACHE_MAX_ENTRIES = 1024
+REDIRECT_PER_HOST_LIMIT = 4
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+ 
+PRIVATE_ADDRESS_MESSAGE = '内部ネットワークのアドレスには接続しません'
+ 
+# 内部ネットワーク・ループバックなどのアドレスか
+def is_private_address(address):
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return (address.is_private or address.is_loopback or address.is_link_local
+            or address.is_reserved or address.is_multicast or address.is_unspecified)
+ 
+# ホスト名がIPアドレスそのもので、かつ内部アドレスか
+def is_private_ip_literal(hostname):
+    try:
+        return is_private_address(ipaddress.ip_address(hostname))
+    except ValueError:
+        return False
+ 
+# 内部アドレスしか持たないホストへの接続を拒否した場合のエラー
+class PrivateAddressError(OSError):
+    pass
+ 
+if aiohttp is not None:
+    # 名前解決の結果から内部アドレスを取り除くリゾルバ
+    class PublicAddressResolver(aiohttp.abc.AbstractResolver):
+        def __init__(self):
+            self._resolver = aiohttp.DefaultResolver()
+
+        async def resolve(self, host, port=0, family=socket.AF_INET):
+            results = await self._resolver.resolve(host, port, family)
+            public = [r for r in results if not is_private_address(ipaddress.ip_address(r['host']))]
+            if not public:
+                raise PrivateAddressError(f"{host} は内部ネットワークのアドレスです")
+            return public
+
+        async def close(self):
+            await self._resolver.close()
+ 
+# 短縮URL・リダイレクトの最終的なリンク先を調べる
+class RedirectResolver:
+    # 専用スレッドのイベントループ上でaiohttpのセッションを共有し、接続を使い回す。
+    # 同一ホストへの同時接続数、ホップ数、全体の所要時間に上限を設け、
+    # 解決済みのリンク先は一定時間キャッシュする。
+    # allow_private_hosts=True はローカルのテスト用サーバーに接続する場合のみ使う。
+
+    def __init__(self, max_hops=REDIRECT_MAX_HOPS, timeout=REDIRECT_TIMEOUT_SECONDS,
+                 cache_ttl=REDIRECT_CACHE_TTL_SECONDS, per_host_limit=REDIRECT_PER_HOST_LIMIT,
+                 allow_private_hosts=False):
+        self.max_hops = max_hops
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.per_host_limit = per_host_limit
+        self.allow_private_hosts = allow_private_hosts
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._session = None
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+
+    def resolve(self, url):
+        now = time.monotonic()
+        with self._cache_lock:
+            cached = self._cache.get(url)
+            if cached and cached[0] > now:
+                self._cache.move_to_end(url)
+                return cached[1]
+       
+        future = asyncio.run_coroutine_threadsafe(self._resolve(url), self._loop)
+        try:
+            result = future.result(self.timeout + 1)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            result = {'url': url, 'final_url': url, 'chain': [url], 'error': 'リダイレクトの追跡がタイムアウトしました'}
+       
+        # 失敗した結果は次回やり直せるようキャッシュしない
+        if result['error'] is None:
+            # 上限を超えたら最も長く使われていないものから捨てる
+            with self._cache_lock:
+                self._cache[url] = (now + self.cache_ttl, result)
+                self._cache.move_to_end(url)
+                while len(self._cache) > REDIRECT_CACHE_MAX_ENTRIES:
+                    self._cache.popitem(last=False)
+        return result
+
+    def close(self):
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result(self.timeout)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _get_session(self):
+        if self._session is None:
+            # 接続時の名前解決の結果から内部アドレスを除くため、確認したアドレスにそのまま接続される
+            resolver = None if self.allow_private_hosts else PublicAddressResolver()
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit_per_host=self.per_host_limit,
+                    ttl_dns_cache=300,
+                    resolver=resolver
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={'User-Agent': 'Mozilla/5.0 (compatible; ScamCheckLinkResolver/1.0)'}
+            )
+        return self._session
+
+    async def _resolve(self, url):
+        chain = [url]
+        try:
+            return await asyncio.wait_for(self._follow(url, chain), self.timeout)
+        except asyncio.TimeoutError:
+            error = 'リダイレクトの追跡がタイムアウトしました'
+        except aiohttp.ClientConnectorError as e:
+            if isinstance(e.os_error, PrivateAddressError):
+                error = PRIVATE_ADDRESS_MESSAGE
+            else:
+                error = f"リンク先に接続できませんでした: {e}"
+        except aiohttp.ClientError as e:
+            error = f"リンク先に接続できませんでした: {e}"
+        except Exception as e:
+            # 不正なホスト名などの入力でURLチェック全体が止まらないようにする
+            error = f"リダイレクトを追跡できませんでした: {e}"
+        return {'url': url, 'final_url': chain[-1], 'chain': chain, 'error': error}
+
+    async def _follow(self, url, chain):
+        session = await self._get_session()
+        current = url
+        while True:
+            parsed = urlparse(current)
+            if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+                return {'url': url, 'final_url': current, 'chain': chain, 'error': '追跡できないURL形式です'}
+            # IPアドレスが直接書かれている場合は名前解決を経ないのでここで確認する
+            if not self.allow_private_hosts and is_private_ip_literal(parsed.hostname):
+                return {'url': url, 'final_url': current, 'chain': chain, 'error': PRIVATE_ADDRESS_MESSAGE}
+           
+            # HEADに対応していないサーバーはGETで再試行する
+            async with session.head(current, allow_redirects=False) as response:
+                status = response.status
+                location = response.headers.get('Location')
+            if status in (405, 501):
+                async with session.get(current, allow_redirects=False) as response:
+                    status = response.status
+                    location = response.headers.get('Location')
+           
+            if status not in REDIRECT_STATUSES or not location:
+                return {'url': url, 'final_url': current, 'chain': chain, 'error': None}
+            if len(chain) > self.max_hops:
+                return {'url': url, 'final_url': current, 'chain': chain, 'error': f"リダイレクトが{self.max_hops}回を超えたため追跡を中止しました"}
+            current = urljoin(current, location)
+            chain.append(current)
+ 
+# リダイレクト追跡の取得（全セッションで共有）
+@st.cache_resource
+def get_redirect_resolver():
+    if aiohttp is None:
+        return None
+    return RedirectResolver()
+ 
+# リダイレクト先を調べてから最終的なリンク先を分析
+def analyze_url_with_redirects(url, model=None):
+    resolver = get_redirect_resolver()
+    resolved = resolver.resolve(url) if resolver else None
+    target = resolved['final_url'] if resolved else url
+   
+    result = None
+    if model is not None:
+        result = validate_ai_verdict(analyze_url_with_ai(target, model))
+    if result is None:
+        result = analyze_url(target)
+    warnings = result.setdefault('warnings', [])
+   
+    if resolved is None:
+        warnings.append('ℹ️ aiohttpがインストールされていないため、リダイレクト先を追跡できません')
+        return result
+   
+    result['redirect_chain'] = resolved['chain']
+    if resolved['error']:
+        warnings.append(f"⚠️ {resolved['error']}")
+   
+    # 元のURL自体のルールベース判定も反映する
+    if target != url:
+        original = analyze_url(url)
+        if RISK_RANK.get(original['risk_level'], 0) > RISK_RANK.get(result['risk_level'], 0):
+            result['risk_level'] = original['risk_level']
+            result['risk_score'] = max(result['risk_score'], original['risk_score'])
+        warnings += [w for w in original['warnings'] if w not in warnings]
+        result.setdefault('details', []).append(f"↪️ {len(resolved['chain']) - 1}回のリダイレクト後のリンク先を分析しました")
+   
+    # リンク先を追跡できた場合は、手動での確認を促す短縮URLの警告を置き換える
+    if resolved['error'] is None and SHORTENER_WARNING in warnings:
+        warnings.remove(SHORTENER_WARNING)
+        warnings.append(f"ℹ️ 短縮URLです。実際のリンク先 {target} を分析しました")
+    return result
  
 # メインアプリ
 def main():
@@ -557,6 +1216,7 @@ def main():
                     result = analyze_phone_number(phone_number)
 
                 display_risk_result(result)
+                record_lookup(result, 'phone', phone_number)
    
     # URLチェック
     elif tab == "🔗 URLチェック":
@@ -570,19 +1230,29 @@ def main():
         - ✓ IPアドレスが直接使用されていないか
         """)
         url_input = st.text_input("URLを入力", placeholder="例: https://example.com")
+        follow_redirects = st.checkbox(
+            "↪️ 短縮URL・リダイレクト先を追跡する",
+            help="リンク先のサーバーに実際に接続し、最終的なリンク先を分析します"
+        )
 
         if st.button("🔍チェック", type="primary") and url_input:
             with st.spinner("分析中..."):
-                result = None
-                if model and use_ai:
-                    result = analyze_url_with_ai(url_input, model)
+                if follow_redirects:
+                    result = analyze_url_with_redirects(url_input, model if model and use_ai else None)
+                    target_url = result.get('redirect_chain', [url_input])[-1]
+                else:
+                    result = None
+                    if model and use_ai:
+                        result = analyze_url_with_ai(url_input, model)
+                    target_url = url_input
                 
+                if model and use_ai and (result is None or not result['ai_powered']):
+                    st.warning("AI分析に失敗しました。従来の分析を使用します。")
                 if result is None:
-                    if model and use_ai:
-                        st.warning("AI分析に失敗しました。従来の分析を使用します。")
                     result = analyze_url(url_input)
 
                 display_risk_result(result)
+                record_lookup(result, 'url', target_url)
        
         
    
@@ -597,20 +1267,28 @@ def main():
         - ✓ 不自然な日本語はないか
         - ✓ リンク先が正規サイトか
         """)
+        live_preview = st.checkbox(
+            "⚡ ライブプレビュー（入力を確定するたびに自動で再チェック）",
+            help="入力欄の外をクリックするか Ctrl+Enter で入力が確定します"
+        )
         email_content = st.text_area("メール本文を入力", placeholder="メールの内容を貼り付けてください", height=200)
+        check_clicked = st.button('🔍チェック', type="primary")
 
-        if st.button('🔍チェック', type="primary") and email_content:
+        if (check_clicked or live_preview) and email_content:
             with st.spinner("AI分析中..."):
-                result = None
-                if model and use_ai:
-                    result = analyze_email_with_ai(email_content, model)
+                result = analyze_email_entities(
+                    email_content,
+                    model if model and use_ai else None,
+                    cache=st.session_state.email_analysis_cache
+                )
 
-                if result is None:
-                    if model and use_ai:
-                        st.warning("AI分析に失敗しました。従来の分析を使用します。")
-                    result = analyze_email(email_content)
+                if model and use_ai and not result['ai_powered']:
+                    st.warning("AI分析に失敗しました。従来の分析を使用します。")
            
                 display_risk_result(result)
+                # ライブプレビューの途中経過は記録しない
+                if check_clicked:
+                    record_lookup(result, 'email', email_content)
        
         
    
@@ -684,6 +1362,54 @@ def main():
         st.subheader("💬 疑わしいキーワード")
         keywords = ['verify account', 'urgent action', 'suspended', 'アカウント確認', '緊急', '本人確認', 'パスワード更新', 'セキュリティ警告', '24時間以内', '今すぐ']
         st.write(" • ".join([f"`{k}`" for k in keywords]))
+       
+        # 利用者のチェック結果から集計したトレンド
+        st.subheader("📈 よくチェックされている番号・ドメイン")
+        store = get_telemetry_store()
+        if store is None:
+            st.info("チェック履歴を保存できないため、トレンドは表示できません")
+        else:
+            try:
+                store.flush()
+            except Exception:
+                st.warning("最新のチェック結果を保存できませんでした。しばらくしてから再度表示してください")
+            window_labels = {"直近1時間": 1, "直近24時間": 24, "直近7日間": TELEMETRY_RETENTION_HOURS}
+            window = st.radio("集計期間", list(window_labels), index=1, horizontal=True)
+            hours = window_labels[window]
+           
+            col1, col2 = st.columns(2)
+            with col1:
+                st.markdown("**📞 電話番号**")
+                rows = store.trending('phone', hours=hours)
+                if rows:
+                    st.dataframe(
+                        [{'電話番号': r['entity'], 'チェック数': r['lookups'], '最大リスクスコア': r['max_risk_score']} for r in rows],
+                        hide_index=True,
+                        use_container_width=True
+                    )
+                else:
+                    st.caption("まだ記録がありません")
+            with col2:
+                st.markdown("**🌐 ドメイン**")
+                rows = store.trending('url', hours=hours)
+                if rows:
+                    st.dataframe(
+                        [{'ドメイン': r['entity'], 'チェック数': r['lookups'], '最大リスクスコア': r['max_risk_score']} for r in rows],
+                        hide_index=True,
+                        use_container_width=True
+                    )
+                else:
+                    st.caption("まだ記録がありません")
+           
+            # 判定別の件数は集計期間によらず全期間の累計
+            totals = store.risk_totals()
+            if totals:
+                st.markdown("**📊 これまでのチェック件数（全期間）**")
+                kind_labels = {'phone': '📞 電話番号', 'url': '🔗 URL', 'email': '📧 メール'}
+                cols = st.columns(len(kind_labels))
+                for i, (kind, label) in enumerate(kind_labels.items()):
+                    counts = totals.get(kind, {})
+                    cols[i].metric(label, f"{sum(counts.values())} 件", f"危険 {counts.get('危険', 0)} 件", delta_color="inverse")
    
     # 使い方ガイド
     elif tab == "📖 使い方ガイド":
@@ -0,0 +1,41 @@
+import importlib.util
+import os
+import sys
+import types
+
+import pytest
+
+APP_PATH = os.path.join(os.path.dirname(__file__), os.pardir, "a", "Laevateinn0131.py")
+
+
+class _SessionState(dict):
+    __getattr__ = dict.get
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+
+def _load_app(monkeypatch):
+    # streamlit / Gemini はUIとAPI呼び出しにしか使わないため、テストでは最小限の代替を使う
+    streamlit = types.ModuleType("streamlit")
+    streamlit.session_state = _SessionState()
+    streamlit.set_page_config = lambda **kwargs: None
+    streamlit.cache_resource = lambda func: func
+    streamlit.error = lambda *args, **kwargs: None
+    google = types.ModuleType("google")
+    genai = types.ModuleType("google.generativeai")
+    google.generativeai = genai
+    monkeypatch.setitem(sys.modules, "streamlit", streamlit)
+    monkeypatch.setitem(sys.modules, "google", google)
+    monkeypatch.setitem(sys.modules, "google.generativeai", genai)
+
+    spec = importlib.util.spec_from_file_location("laevateinn_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    monkeypatch.setenv("LOOKUP_TELEMETRY_DB", str(tmp_path / "lookup_telemetry.db"))
+    return _load_app(monkeypatch)
@@ -0,0 +1,106 @@
+import json
+
+
+class FakeModel:
+    def __init__(self, response):
+        self.response = response
+        self.prompts = []
+
+    def generate_content(self, prompt):
+        self.prompts.append(prompt)
+        text = self.response if isinstance(self.response, str) else json.dumps(self.response, ensure_ascii=False)
+        return type("Response", (), {"text": text})()
+
+
+def test_extracts_phone_numbers_and_urls(app):
+    content = "０５０－１２３４－５６７８ または +852-5808-4321 へ。詳細は http://example.com/?id=0312345678 まで"
+
+    entities = app.extract_entities(content)
+
+    assert entities["phones"] == ["050-1234-5678", "+852-5808-4321"]
+    assert entities["urls"] == ["http://example.com/?id=0312345678"]
+
+
+def test_phone_extraction_skips_dates_and_short_numbers(app):
+    content = "2024-10-12 に発送。注文番号 012-345、金額 0120 円"
+
+    assert app.extract_entities(content)["phones"] == []
+
+
+def test_duplicate_phone_numbers_are_reported_once(app):
+    content = "03-1234-5678 / 0312345678"
+
+    assert app.extract_entities(content)["phones"] == ["03-1234-5678"]
+
+
+def test_malformed_url_entity_does_not_break_ai_check(app):
+    model = FakeModel({"risk_level": "注意", "risk_score": 50, "warnings": [], "entities": []})
+
+    result = app.analyze_email_entities("click http://[abc now", model)
+
+    url = next(e for e in result["entities"] if e["kind"] == "url")
+    assert url["risk_level"] == "エラー"
+    assert "http://[abc" not in model.prompts[0].split("判定対象の電話番号・URL:")[1]
+
+
+def test_only_ambiguous_entities_are_sent_in_one_call(app):
+    model = FakeModel({
+        "risk_level": "注意",
+        "risk_score": 50,
+        "warnings": [],
+        "entities": [{"id": 1, "risk_level": "危険", "risk_score": 88, "warnings": ["AI"]}],
+    })
+
+    result = app.analyze_email_entities("050-1234-5678 と 03-1234-5678", model)
+
+    assert len(model.prompts) == 1
+    assert "[1] 電話番号: 050-1234-5678" in model.prompts[0]
+    assert "03-1234-5678" not in model.prompts[0].split("判定対象の電話番号・URL:")[1]
+    ip_phone = result["entities"][0]
+    assert (ip_phone["risk_level"], ip_phone["risk_score"], ip_phone["ai_powered"]) == ("危険", 88, True)
+    assert result["risk_level"] == "危険"
+
+
+def test_out_of_range_ids_are_ignored(app):
+    model = FakeModel({
+        "risk_level": "注意",
+        "risk_score": 50,
+        "warnings": [],
+        "entities": [
+            {"id": 0, "risk_level": "危険", "risk_score": 99},
+            {"id": -1, "risk_level": "危険", "risk_score": 99},
+            {"id": 3, "risk_level": "危険", "risk_score": 99},
+        ],
+    })
+
+    result = app.analyze_email_entities("050-1234-5678 と +852-5808-4321", model)
+
+    assert [e["risk_score"] for e in result["entities"]] == [60, 70]
+
+
+def test_malformed_ai_output_falls_back_to_rules(app):
+    for response in (
+        {"risk_level": "注意", "risk_score": 50, "warnings": "bad"},
+        {"risk_level": "不明", "risk_score": 50},
+        {"risk_level": "注意", "risk_score": "高い"},
+        "[1, 2]",
+    ):
+        result = app.analyze_email_entities("050-1234-5678", FakeModel(response))
+
+        assert result["ai_powered"] is False
+        assert result["risk_score"] == 60
+
+
+def test_malformed_entity_verdict_is_skipped(app):
+    model = FakeModel({
+        "risk_level": "注意",
+        "risk_score": "55",
+        "warnings": [],
+        "entities": [{"id": 1, "risk_level": "危険", "risk_score": "88", "warnings": "bad"}],
+    })
+
+    result = app.analyze_email_entities("050-1234-5678", model)
+
+    assert result["ai_powered"] is True
+    assert result["entities"][0]["ai_powered"] is False
+    assert result["risk_score"] == 60
@@ -0,0 +1,131 @@
+import json
+
+BASE_EMAIL = (
+    "緊急のお知らせです。アカウント確認のため 050-1234-5678 へお電話ください。\n\n"
+    "詳細は http://example.com をご覧ください。今すぐ対応をお願いします。"
+)
+
+
+class CountingModel:
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, prompt):
+        self.calls += 1
+        response = {
+            "risk_level": "注意",
+            "risk_score": 55,
+            "warnings": [],
+            "ai_analysis": f"call {self.calls}",
+            "entities": [{"id": 1, "risk_level": "危険", "risk_score": 88, "warnings": []}],
+        }
+        return type("Response", (), {"text": json.dumps(response, ensure_ascii=False)})()
+
+
+def _count_calls(app, monkeypatch, name):
+    calls = []
+    original = getattr(app, name)
+
+    def counted(value):
+        calls.append(value)
+        return original(value)
+
+    monkeypatch.setattr(app, name, counted)
+    return calls
+
+
+def test_only_changed_paragraphs_are_rescanned(app, monkeypatch):
+    scanned = _count_calls(app, monkeypatch, "scan_email_text")
+    cache = {}
+
+    app.analyze_email_entities(BASE_EMAIL, cache=cache)
+    assert len(scanned) == 2
+
+    scanned.clear()
+    app.analyze_email_entities(BASE_EMAIL + "\n\n追記: よろしくお願いします。", cache=cache)
+    assert scanned == ["追記: よろしくお願いします。"]
+
+
+def test_removed_paragraphs_are_dropped_from_cache(app):
+    cache = {}
+    app.analyze_email_entities(BASE_EMAIL, cache=cache)
+
+    result = app.analyze_email_entities(BASE_EMAIL.split("\n\n")[0], cache=cache)
+
+    assert len(cache["paragraphs"]) == 1
+    assert [e["kind"] for e in result["entities"]] == ["phone"]
+
+
+def test_analysed_urls_are_reused(app, monkeypatch):
+    analysed = _count_calls(app, monkeypatch, "analyze_url")
+    cache = {}
+
+    app.analyze_email_entities(BASE_EMAIL, cache=cache)
+    app.analyze_email_entities(BASE_EMAIL.replace("今すぐ", "直ちに"), cache=cache)
+
+    assert analysed == ["http://example.com"]
+
+
+def test_incremental_result_matches_full_analysis(app):
+    cache = {}
+    app.analyze_email_entities("前置きの段落です。", cache=cache)
+
+    incremental = app.analyze_email_entities(BASE_EMAIL, cache=cache)
+    full = app.analyze_email_entities(BASE_EMAIL)
+
+    assert incremental == full
+
+
+def test_cached_ai_verdict_is_not_mutated(app):
+    model = CountingModel()
+    cache = {}
+
+    app.analyze_email_entities(BASE_EMAIL, model, cache=cache)
+    result = app.analyze_email_entities(BASE_EMAIL, model, cache=cache)
+
+    assert result["entities"][0]["warnings"].count("⚠️ IP電話は匿名性が高く、詐欺に悪用されやすい") == 1
+    assert cache["entities"][("phone", "050-1234-5678")]["risk_level"] == "注意"
+
+
+def test_ai_is_reused_for_cosmetic_edits(app):
+    model = CountingModel()
+    cache = {}
+
+    app.analyze_email_entities(BASE_EMAIL, model, cache=cache)
+    result = app.analyze_email_entities(BASE_EMAIL.replace("。", "、").replace(" ", "  "), model, cache=cache)
+
+    assert model.calls == 1
+    assert result["ai_analysis"] == "call 1"
+    assert result["entities"][0]["risk_level"] == "危険"
+
+
+def test_ai_is_reissued_when_content_changes_materially(app):
+    model = CountingModel()
+    cache = {}
+
+    app.analyze_email_entities(BASE_EMAIL, model, cache=cache)
+    app.analyze_email_entities(
+        BASE_EMAIL + "\n\nご請求金額が未払いのため、本日中にコンビニでギフトカードを購入し番号を返信してください。",
+        model,
+        cache=cache,
+    )
+
+    assert model.calls == 2
+
+
+def test_ai_is_reissued_for_new_ambiguous_entity(app):
+    model = CountingModel()
+    cache = {}
+
+    app.analyze_email_entities(BASE_EMAIL, model, cache=cache)
+    app.analyze_email_entities(BASE_EMAIL + "\n\n+852-5808-4321", model, cache=cache)
+
+    assert model.calls == 2
+
+
+def test_fingerprint_ignores_width_case_and_punctuation(app):
+    a = app.content_fingerprint("ＡＢＣアカウント確認、今すぐ!")
+    b = app.content_fingerprint("abc アカウント確認。 今すぐ")
+
+    assert app.fingerprint_similarity(a, b) == 1.0
+    assert app.fingerprint_similarity(a, app.content_fingerprint("まったく別の内容です")) < app.AI_REANALYSIS_SIMILARITY
@@ -0,0 +1,150 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+
+class RedirectHandler(BaseHTTPRequestHandler):
+    hits = []
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self):
+        RedirectHandler.hits.append((self.command, self.path))
+        if self.path.startswith("/chain/"):
+            remaining = int(self.path.rsplit("/", 1)[1])
+            location = f"/chain/{remaining - 1}" if remaining > 1 else "/final"
+            self._redirect(302, location)
+        elif self.path == "/loop":
+            self._redirect(301, "/loop")
+        elif self.path == "/no-head":
+            if self.command == "HEAD":
+                self.send_response(405)
+                self.end_headers()
+            else:
+                self._redirect(302, "/final")
+        elif self.path == "/slow":
+            time.sleep(2)
+            self.send_response(200)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.end_headers()
+
+    def _redirect(self, status, location):
+        self.send_response(status)
+        self.send_header("Location", location)
+        self.end_headers()
+
+    do_HEAD = _respond
+    do_GET = _respond
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RedirectHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    RedirectHandler.hits = []
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def resolver(app):
+    resolver = app.RedirectResolver(allow_private_hosts=True, timeout=1.0)
+    yield resolver
+    resolver.close()
+
+
+def test_follows_redirect_chain(server, resolver):
+    result = resolver.resolve(f"{server}/chain/3")
+
+    assert result["error"] is None
+    assert result["final_url"] == f"{server}/final"
+    assert result["chain"] == [
+        f"{server}/chain/3",
+        f"{server}/chain/2",
+        f"{server}/chain/1",
+        f"{server}/final",
+    ]
+
+
+def test_resolved_destination_is_cached(server, resolver):
+    resolver.resolve(f"{server}/chain/2")
+    hits = len(RedirectHandler.hits)
+
+    result = resolver.resolve(f"{server}/chain/2")
+
+    assert result["final_url"] == f"{server}/final"
+    assert len(RedirectHandler.hits) == hits
+
+
+def test_stops_after_max_hops(server, resolver):
+    result = resolver.resolve(f"{server}/loop")
+
+    assert result["error"] is not None
+    assert len(result["chain"]) == resolver.max_hops + 1
+
+
+def test_falls_back_to_get_when_head_is_not_allowed(server, resolver):
+    result = resolver.resolve(f"{server}/no-head")
+
+    assert result["final_url"] == f"{server}/final"
+    assert ("GET", "/no-head") in RedirectHandler.hits
+
+
+def test_times_out_on_slow_host(server, resolver):
+    result = resolver.resolve(f"{server}/slow")
+
+    assert result["error"] == "リダイレクトの追跡がタイムアウトしました"
+
+
+def test_refuses_private_hosts_by_default(server, app):
+    resolver = app.RedirectResolver(timeout=1.0)
+    try:
+        literal = resolver.resolve(f"{server}/chain/1")
+        named = resolver.resolve(server.replace("127.0.0.1", "localhost") + "/chain/1")
+    finally:
+        resolver.close()
+
+    assert literal["error"] == app.PRIVATE_ADDRESS_MESSAGE
+    assert named["error"] == app.PRIVATE_ADDRESS_MESSAGE
+    assert RedirectHandler.hits == []
+
+
+def test_invalid_hostname_returns_error(resolver):
+    result = resolver.resolve("http://" + "a" * 70 + ".com/")
+
+    assert result["error"] is not None
+    assert result["final_url"] == "http://" + "a" * 70 + ".com/"
+
+
+def test_cache_is_bounded(server, app, resolver, monkeypatch):
+    monkeypatch.setattr(app, "REDIRECT_CACHE_MAX_ENTRIES", 2)
+    for path in ("/chain/1", "/chain/2", "/chain/3"):
+        resolver.resolve(server + path)
+
+    assert list(resolver._cache) == [f"{server}/chain/2", f"{server}/chain/3"]
+
+
+def test_resolved_shortener_drops_manual_check_warning(app, monkeypatch):
+    class StubResolver:
+        def resolve(self, url):
+            return {
+                "url": url,
+                "final_url": "https://example.com/landing",
+                "chain": [url, "https://example.com/landing"],
+                "error": None,
+            }
+
+    monkeypatch.setattr(app, "get_redirect_resolver", lambda: StubResolver())
+
+    result = app.analyze_url_with_redirects("https://bit.ly/abc")
+
+    assert app.SHORTENER_WARNING not in result["warnings"]
+    assert any("https://example.com/landing" in w for w in result["warnings"])
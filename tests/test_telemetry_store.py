@@ -0,0 +1,126 @@
+import sqlite3
+import time
+
+import pytest
+
+
+@pytest.fixture
+def store(app, tmp_path):
+    # 自動書き込みが割り込まないよう、件数・時間のしきい値を大きくしておく
+    return app.LookupTelemetryStore(str(tmp_path / "telemetry.db"), batch_size=10**6, flush_interval=3600)
+
+
+def test_flush_aggregates_counters(store):
+    store.record("phone", "05012345678", "注意", 60, False)
+    store.record("phone", "05012345678", "危険", 90, True)
+    store.record("phone", "0312345678", "危険", 95, False)
+    store.record("url", "example.com", "安全", 10, False)
+
+    store.flush()
+
+    assert store.trending("phone") == [
+        {"entity": "05012345678", "lookups": 2, "max_risk_score": 90},
+        {"entity": "0312345678", "lookups": 1, "max_risk_score": 95},
+    ]
+    assert store.risk_totals() == {
+        "phone": {"注意": 1, "危険": 2},
+        "url": {"安全": 1},
+    }
+
+
+def test_counters_accumulate_across_batches(store):
+    store.record("url", "example.com", "注意", 40, False)
+    store.flush()
+    store.record("url", "example.com", "注意", 50, False)
+    store.flush()
+
+    assert store.trending("url") == [{"entity": "example.com", "lookups": 2, "max_risk_score": 50}]
+
+
+def test_trending_respects_window_and_prunes_old_buckets(app, store):
+    old = time.time() - (app.TELEMETRY_RETENTION_HOURS + 2) * app.TELEMETRY_BUCKET_SECONDS
+    store._buffer.append((old, "url", "old.example", "注意", 50, 0))
+    store._buffer.append((time.time() - 3 * app.TELEMETRY_BUCKET_SECONDS, "url", "recent.example", "注意", 50, 0))
+    store.record("url", "now.example", "注意", 50, False)
+
+    store.flush()
+
+    assert [r["entity"] for r in store.trending("url", hours=1)] == ["now.example"]
+    assert [r["entity"] for r in store.trending("url", hours=24)] == ["now.example", "recent.example"]
+    with sqlite3.connect(store.path) as conn:
+        entities = {row[0] for row in conn.execute("SELECT entity FROM entity_counts")}
+        logged = conn.execute("SELECT COUNT(*) FROM lookups").fetchone()[0]
+    assert "old.example" not in entities
+    assert logged == 3
+
+
+def test_failed_batch_is_requeued(store, monkeypatch):
+    store.record("url", "example.com", "注意", 50, False)
+
+    def fail(batch):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(store, "_write_batch", fail)
+    with pytest.raises(sqlite3.Error):
+        store.flush()
+    assert len(store._buffer) == 1
+
+    monkeypatch.undo()
+    store.flush()
+    assert store._buffer == []
+    assert store.trending("url")[0]["lookups"] == 1
+
+
+def test_record_clamps_or_skips_bad_scores(store):
+    store.record("url", "huge.example", "危険", 10**30, True)
+    store.record("url", "negative.example", "安全", -5, False)
+    store.record("url", "none.example", "注意", None, False)
+    store.record("url", "text.example", "注意", "60点", False)
+
+    store.flush()
+
+    scores = {r["entity"]: r["max_risk_score"] for r in store.trending("url")}
+    assert scores == {"huge.example": 100, "negative.example": 0}
+
+
+def test_flush_loop_survives_unexpected_errors(app, tmp_path, monkeypatch):
+    store = app.LookupTelemetryStore(str(tmp_path / "loop.db"), batch_size=1, flush_interval=0.05)
+    calls = []
+    real_write = store._write_batch
+
+    def flaky_write(batch):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        real_write(batch)
+
+    monkeypatch.setattr(store, "_write_batch", flaky_write)
+    store.record("url", "first.example", "注意", 50, False)
+    time.sleep(0.3)
+    store.record("url", "second.example", "注意", 50, False)
+
+    deadline = time.time() + 3
+    while store._buffer and time.time() < deadline:
+        time.sleep(0.05)
+
+    assert store._buffer == []
+    assert [r["entity"] for r in store.trending("url")] == ["second.example"]
+
+
+def test_normalize_entity(app):
+    assert app.normalize_entity("phone", "０５０－１２３４－５６７８") == "05012345678"
+    assert app.normalize_entity("phone", "+852-5808-4321") == "+85258084321"
+    assert app.normalize_entity("url", "https://WWW.Example.com/path") == "example.com"
+    assert app.normalize_entity("url", "http://[ABC") == "http://[abc"
+    assert "本文" not in app.normalize_entity("email", "本文")
+
+
+def test_record_lookup_never_raises(app):
+    result = {
+        "risk_level": "エラー",
+        "risk_score": 0,
+        "entities": [{"kind": "url", "value": "http://[abc", "risk_level": "エラー", "risk_score": 0}],
+    }
+
+    app.record_lookup(result, "url", "http://[abc")
+    app.record_lookup({"risk_level": "注意"}, "url", "http://[abc")